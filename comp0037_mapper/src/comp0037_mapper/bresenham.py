@@ -0,0 +1,22 @@
+import numpy as np
+
+# Vectorised integer line generation. Given a start and an end cell,
+# return two int32 arrays holding the x and y coordinates of the
+# cells which the line between them passes through, including both
+# endpoints. The line visits the same 8-connected cells as the
+# classic Bresenham algorithm (up to rounding on exact ties), but the
+# coordinates come back as arrays which can be used directly to
+# fancy-index the grid, rather than a Python list of tuples which has
+# to be walked in the interpreter.
+
+def bresenham(start, end):
+    x0, y0 = start
+    x1, y1 = end
+
+    n = max(abs(x1 - x0), abs(y1 - y0)) + 1
+
+    t = np.linspace(0.0, 1.0, n)
+    xs = np.round(x0 + t * (x1 - x0)).astype(np.int32)
+    ys = np.round(y0 + t * (y1 - y0)).astype(np.int32)
+
+    return xs, ys
@@ -0,0 +1,235 @@
+import math
+
+import numpy as np
+
+from occupancy_grid import LOG_ODDS_FREE, LOG_ODDS_OCCUPIED, LOG_ODDS_MIN, LOG_ODDS_MAX, \
+    LOG_ODDS_FREE_THRESHOLD, LOG_ODDS_OCCUPIED_THRESHOLD
+
+# Numba is used, if it is available, to compile the inner per-ray
+# loops to native code. The pure Python implementations below are
+# still used directly if numba is not installed; everything works, it
+# is just a lot slower.
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+    prange = range
+
+# All the kernels work on the flat 1D grid arrays: cell (x, y) lives
+# at index y * width + x. This keeps the address arithmetic down to
+# one multiply-add per cell access.
+
+# Classify a log odds value as free (-1), unknown (0) or blocked (1).
+def _classify(logOdds):
+    if logOdds >= LOG_ODDS_OCCUPIED_THRESHOLD:
+        return 1
+    if logOdds <= LOG_ODDS_FREE_THRESHOLD:
+        return -1
+    return 0
+
+# Apply the log odds update for a single cell: rays passing through a
+# cell make it more likely to be free, rays ending on one make it
+# more likely to be blocked. The delta grid and the returned flag
+# only record changes of classification, not every nudge of the log
+# odds value, so a well-observed cell does not trigger publishes as
+# its value saturates.
+def _update_cell(occ, delta, idx, cellIsHit):
+    oldValue = int(occ[idx])
+    if cellIsHit:
+        newValue = min(oldValue + LOG_ODDS_OCCUPIED, LOG_ODDS_MAX)
+    else:
+        newValue = max(oldValue + LOG_ODDS_FREE, LOG_ODDS_MIN)
+    if newValue == oldValue:
+        return False
+    occ[idx] = newValue
+    if _classify(newValue) == _classify(oldValue):
+        return False
+    delta[idx] = 1
+    return True
+
+# Integrate a single ray into the occupancy and delta grids. This
+# walks the integer Bresenham line from the start cell to the end
+# cell, writing directly into the underlying grid arrays: every cell
+# along the ray receives the free update and, if the ray was stopped
+# by an obstacle, the final cell receives the blocked update instead.
+# Adjacent rays overlap heavily near the sensor, so visited marks
+# the cells which have already been updated by an earlier ray of the
+# same scan; those are stepped over without touching the grid again.
+# Returns True if any cell changed classification.
+def _integrate_ray(occ, delta, visited, width, height, x0, y0, x1, y1, detectObstacle):
+    dx = abs(x1 - x0)
+    dy = abs(y1 - y0)
+    sx = 1 if x0 < x1 else -1
+    sy = 1 if y0 < y1 else -1
+    err = dx - dy
+
+    gridHasChanged = False
+
+    while True:
+        onLastCell = (x0 == x1) and (y0 == y1)
+
+        if (x0 >= 0) and (y0 >= 0) and (x0 < width) and (y0 < height):
+            idx = y0 * width + x0
+            if visited[idx] == 0:
+                visited[idx] = 1
+                if _update_cell(occ, delta, idx, onLastCell and detectObstacle):
+                    gridHasChanged = True
+
+        if onLastCell:
+            break
+
+        e2 = 2 * err
+        if e2 > -dy:
+            err = err - dy
+            x0 = x0 + sx
+        if e2 < dx:
+            err = err + dx
+            y0 = y0 + sy
+
+    return gridHasChanged
+
+# Integrate a single ray by marching along it rather than visiting
+# every cell. dt holds the chessboard distance transform of the cells
+# which are not already classified as free: if dt at the current cell
+# is d > 0, the cell and the next d - 1 cells along the ray are all
+# already free and more free evidence cannot change their
+# classification, so the march jumps straight over them. Close to
+# obstacles and in unexplored space dt is 0 and this degrades to
+# stepping one cell at a time, just like the Bresenham traversal.
+# Most of a ray through mapped free space is skipped in a handful of
+# jumps.
+def _march_ray(occ, delta, dt, visited, width, height, x0, y0, x1, y1, detectObstacle):
+    gridHasChanged = False
+
+    n = max(abs(x1 - x0), abs(y1 - y0))
+
+    if n > 0:
+        fx = float(x1 - x0) / n
+        fy = float(y1 - y0) / n
+
+        i = 0
+        while i < n:
+            px = int(math.floor(x0 + fx * i + 0.5))
+            py = int(math.floor(y0 + fy * i + 0.5))
+
+            if (px < 0) or (py < 0) or (px >= width) or (py >= height):
+                i = i + 1
+                continue
+
+            idx = py * width + px
+            d = dt[idx]
+            if d > 0:
+                # This cell and the next d - 1 are already free.
+                i = i + d
+                continue
+
+            if visited[idx] == 0:
+                visited[idx] = 1
+                if _update_cell(occ, delta, idx, False):
+                    gridHasChanged = True
+
+            i = i + 1
+
+    # The final cell is where the ray stopped, so it gets the blocked
+    # update if the ray hit an obstacle.
+    if (x1 >= 0) and (y1 >= 0) and (x1 < width) and (y1 < height):
+        idx = y1 * width + x1
+        if visited[idx] == 0:
+            visited[idx] = 1
+            if _update_cell(occ, delta, idx, detectObstacle):
+                gridHasChanged = True
+
+    return gridHasChanged
+
+# Integrate a whole scan in one call. The endpoint arrays hold the
+# precomputed end cell of every valid ray; each ray is traced with
+# the marching kernel if useDistanceTransform is set and with the
+# Bresenham kernel otherwise. Doing the whole scan inside one
+# compiled function removes the remaining per-ray Python dispatch
+# from parseScan. Returns True if any cell changed classification.
+#
+# The rays are traced in parallel. Two rays can race on the visited
+# test for a cell they share, in which case that cell receives one
+# extra log odds vote in the scan; the saturating update bounds the
+# effect, so the kernel deliberately uses no locking.
+def _integrate_scan(occ, delta, dt, visited, width, height, x0, y0, endX, endY,
+                    detectObstacle, useDistanceTransform):
+    numberOfChangedRays = 0
+
+    for i in prange(endX.shape[0]):
+        if useDistanceTransform:
+            rayHasChangedGrid = march_ray(occ, delta, dt, visited, width, height,
+                                          x0, y0, endX[i], endY[i], detectObstacle[i])
+        else:
+            rayHasChangedGrid = integrate_ray(occ, delta, visited, width, height,
+                                              x0, y0, endX[i], endY[i], detectObstacle[i])
+        if rayHasChangedGrid:
+            numberOfChangedRays += 1
+
+    return numberOfChangedRays > 0
+
+if njit is not None:
+    _classify = njit(cache=True)(_classify)
+    _update_cell = njit(cache=True)(_update_cell)
+    integrate_ray = njit(cache=True)(_integrate_ray)
+    march_ray = njit(cache=True)(_march_ray)
+    integrate_scan = njit(cache=True, parallel=True)(_integrate_scan)
+else:
+    from bresenham import bresenham
+
+    integrate_ray = _integrate_ray
+    march_ray = _march_ray
+
+    # Classify an array of log odds values; vectorised counterpart
+    # of _classify.
+    def _classify_array(values):
+        return np.where(values >= LOG_ODDS_OCCUPIED_THRESHOLD, 1,
+                        np.where(values <= LOG_ODDS_FREE_THRESHOLD, -1, 0))
+
+    # Without numba the cell-at-a-time kernels above run in the
+    # interpreter, which is far too slow at scan rate. Instead each
+    # ray's cells are generated as index arrays and the whole log
+    # odds update is applied with fancy indexing, so the interpreter
+    # only runs a handful of numpy operations per ray.
+    def _integrate_ray_numpy(occ, delta, visited, width, height, x0, y0, x1, y1,
+                             detectObstacle):
+        xs, ys = bresenham((x0, y0), (x1, y1))
+
+        inGrid = (xs >= 0) & (ys >= 0) & (xs < width) & (ys < height)
+        cellIndices = ys[inGrid].astype(np.intp) * width + xs[inGrid]
+        if cellIndices.shape[0] == 0:
+            return False
+
+        cellIsHit = np.zeros(cellIndices.shape[0], dtype=bool)
+        if detectObstacle and inGrid[-1]:
+            cellIsHit[-1] = True
+
+        unvisited = visited[cellIndices] == 0
+        cellIndices = cellIndices[unvisited]
+        cellIsHit = cellIsHit[unvisited]
+        if cellIndices.shape[0] == 0:
+            return False
+        visited[cellIndices] = 1
+
+        oldValues = occ[cellIndices].astype(np.int32)
+        newValues = np.where(cellIsHit,
+                             np.minimum(oldValues + LOG_ODDS_OCCUPIED, LOG_ODDS_MAX),
+                             np.maximum(oldValues + LOG_ODDS_FREE, LOG_ODDS_MIN))
+        occ[cellIndices] = newValues.astype(np.int8)
+
+        changed = _classify_array(newValues) != _classify_array(oldValues)
+        if not changed.any():
+            return False
+        delta[cellIndices[changed]] = 1
+        return True
+
+    def _integrate_scan_numpy(occ, delta, dt, visited, width, height, x0, y0, endX, endY,
+                              detectObstacle, useDistanceTransform):
+        gridHasChanged = False
+        for i in range(endX.shape[0]):
+            if _integrate_ray_numpy(occ, delta, visited, width, height, x0, y0,
+                                    int(endX[i]), int(endY[i]), bool(detectObstacle[i])):
+                gridHasChanged = True
+        return gridHasChanged
+
+    integrate_scan = _integrate_scan_numpy
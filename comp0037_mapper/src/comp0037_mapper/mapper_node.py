@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+
+import rospy
+import math
+import numpy as np
+
+from geometry_msgs.msg import Twist
+from nav_msgs.msg import Odometry
+from sensor_msgs.msg import LaserScan
+
+from comp0037_mapper.msg import MapUpdate
+from occupancy_grid import OccupancyGrid, LOG_ODDS_FREE_THRESHOLD
+from mapper_kernels import integrate_scan
+
+# scipy is only needed for the distance transform used by the ray
+# marching fast path; without it every ray falls back to the
+# cell-by-cell Bresenham traversal.
+try:
+    from scipy.ndimage import distance_transform_cdt
+except ImportError:
+    distance_transform_cdt = None
+
+# This node builds up an occupancy grid of the world from the laser
+# scans produced by the stdr simulator. Each scan is registered
+# against the predicted pose of the robot at the time the scan was
+# taken, the cells along each ray accumulate free evidence and, if
+# the ray hit an obstacle, the cell at the end of the ray accumulates
+# blocked evidence. As cells change classification, MapUpdate
+# messages go out carrying the changed cells, with the full grid
+# included periodically as a keyframe.
+
+class MapperNode(object):
+
+    def __init__(self):
+        rospy.init_node('mapper_node', anonymous=True)
+
+        # The dimensions of the workspace, in metres, and the size of
+        # each grid cell.
+        mapWidth = rospy.get_param('map_width', 21.0)
+        mapHeight = rospy.get_param('map_height', 21.0)
+        mapResolution = rospy.get_param('map_resolution', 0.05)
+
+        widthInCells = int(mapWidth / mapResolution)
+        heightInCells = int(mapHeight / mapResolution)
+
+        self.occupancyGrid = OccupancyGrid(widthInCells, heightInCells, mapResolution)
+
+        # The world-to-cell conversion constants never change once
+        # the grid is built, so cache them here and inline the
+        # conversion on the scan path instead of calling into
+        # OccupancyGrid for every scan.
+        self.inverseResolution = 1.0 / self.occupancyGrid.getResolution()
+        self.gridOriginX = self.occupancyGrid.originX
+        self.gridOriginY = self.occupancyGrid.originY
+
+        # The delta grid records which cells have changed since the
+        # last map update message was sent out.
+        self.deltaOccupancyGrid = OccupancyGrid(widthInCells, heightInCells, mapResolution, 0)
+
+        # Per-scan mask of the cells which have already been updated
+        # by an earlier ray of the current scan. Adjacent rays overlap
+        # heavily near the sensor, so this saves each overlapped cell
+        # being rewritten once per ray. Allocated once and cleared
+        # after every scan.
+        self.visitedCells = np.zeros(heightInCells * widthInCells, dtype=np.uint8)
+
+        # Cached cos / sin tables for the scan-relative ray angles,
+        # together with the per-scan scratch buffers. These only
+        # depend on the scan geometry, which never changes from scan
+        # to scan, so they are all allocated once on the first scan
+        # and reused from then on.
+        self.scanRayTableKey = None
+        self.scanRayCosTable = None
+        self.scanRaySinTable = None
+        self.scratchRanges = None
+        self.scratchValid = None
+        self.scratchDetectObstacle = None
+        self.scratchEndWorldX = None
+        self.scratchEndWorldY = None
+        self.scratchEndCellX = None
+        self.scratchEndCellY = None
+        self.scratchTemp = None
+
+        # Placeholder handed to the kernel when the real distance
+        # transform is unavailable.
+        self.emptyDistanceTransform = np.zeros(1, dtype=np.int32)
+
+        # Chessboard distance transform of the cells which are not
+        # already marked free. The ray marching kernel uses it to jump
+        # over runs of known free space. It only needs recomputing
+        # after a scan actually changed the grid.
+        self.freeSpaceDistanceTransform = None
+        self.freeSpaceDistanceTransformStale = True
+
+        # The most recent odometry and velocity command. The
+        # callbacks replace the whole message object with a single
+        # assignment, which is atomic under the GIL, and received
+        # messages are never mutated afterwards. A reader therefore
+        # just grabs the current reference and reads through that; no
+        # locking is needed anywhere.
+        self.mostRecentOdometry = Odometry()
+        self.mostRecentTwist = Twist()
+
+        # Map updates are published as sparse deltas, with the full
+        # grid included as a keyframe at most this often (seconds).
+        self.keyframeInterval = rospy.get_param('map_keyframe_interval', 5.0)
+        self.lastKeyframeTime = None
+        self.keyframeSequenceNumber = 0
+
+        # Small deltas are batched up across scans: an update goes
+        # out once at least this many cells have changed, or this
+        # much time has passed since the last publish, whichever
+        # comes first. The delta grid accumulates naturally because
+        # it is only cleared when an update is actually sent.
+        self.changedCellPublishThreshold = rospy.get_param('map_changed_cell_threshold', 16)
+        self.maximumPublishInterval = rospy.get_param('map_publish_interval', 1.0)
+        self.lastPublishTime = None
+
+        self.mapUpdatePublisher = rospy.Publisher('updated_map', MapUpdate, queue_size=1)
+
+        self.odometrySubscriber = rospy.Subscriber('robot0/odom', Odometry, self.odometryCallback,
+                                                   queue_size=1)
+        self.twistSubscriber = rospy.Subscriber('robot0/cmd_vel', Twist, self.twistCallback,
+                                                queue_size=1)
+        self.laserSubscriber = rospy.Subscriber('robot0/laser_0', LaserScan, self.laserScanCallback,
+                                                queue_size=1)
+
+    def odometryCallback(self, msg):
+        self.mostRecentOdometry = msg
+
+    def twistCallback(self, msg):
+        self.mostRecentTwist = msg
+
+    # Predict the pose of the robot at a given time. The odometry
+    # updates run at a fairly low rate, so we take the most recent
+    # odometry estimate and extrapolate it forwards to the requested
+    # time using the most recent velocity command.
+    def predictPose(self, predictTime):
+        # Grab the current message references once; the callbacks
+        # swap in whole new message objects and never mutate old
+        # ones, so everything read through a local reference is a
+        # consistent snapshot without any locking.
+        odometry = self.mostRecentOdometry
+        twist = self.mostRecentTwist
+        positionX = odometry.pose.pose.position.x
+        positionY = odometry.pose.pose.position.y
+        orientationZ = odometry.pose.pose.orientation.z
+        orientationW = odometry.pose.pose.orientation.w
+        odometryStamp = odometry.header.stamp
+        v = twist.linear.x
+        w = twist.angular.z
+
+        dT = (predictTime - odometryStamp).to_sec()
+        theta = 2 * math.atan2(orientationZ, orientationW)
+
+        # Bind the trig functions to locals: the curved motion branch
+        # used them without the math prefix, which raised a NameError
+        # the first time the robot actually turned, and the aliases
+        # also save an attribute lookup per call on this per-scan
+        # path.
+        sin = math.sin
+        cos = math.cos
+
+        if abs(w) < 1e-3:
+            # Straight line motion.
+            x = positionX + v * dT * cos(theta)
+            y = positionY + v * dT * sin(theta)
+            thetaNew = theta
+        else:
+            # Moving along an arc of a circle of radius v / w.
+            r = v / w
+            thetaNew = theta + w * dT
+            x = positionX + r * (sin(thetaNew) - sin(theta))
+            y = positionY - r * (cos(thetaNew) - cos(theta))
+
+        return x, y, thetaNew
+
+    # Register a scan against the grid. The ray angles, ray endpoints
+    # and the conversion from workspace coordinates to cell
+    # coordinates are all computed for the whole scan in one go using
+    # numpy; the per-ray traversal happens inside a single compiled
+    # kernel call.
+    def parseScan(self, msg):
+        # Predict the pose of the robot at the time the scan was taken.
+        x, y, theta = self.predictPose(msg.header.stamp)
+
+        # All the per-scan arrays live in scratch buffers which are
+        # allocated once, on the first scan, and reused; a 10-30 Hz
+        # scan loop should not be churning the allocator.
+        cosTable, sinTable = self.getScanRayTables(msg, len(msg.ranges))
+
+        ranges = self.scratchRanges
+        ranges[:] = msg.ranges
+
+        # Rays which report less than the minimum range, or a NaN,
+        # are invalid and get skipped. Rays which report more than
+        # the maximum range saw no obstacle; they still clear the
+        # cells they pass through, but their endpoint is clamped and
+        # not marked as blocked. All the validity and clamping logic
+        # is done here with array operations, so only the valid rays
+        # are handed on to the scan kernel.
+        valid = np.greater(ranges, msg.range_min, out=self.scratchValid)
+        detectObstacle = np.less(ranges, msg.range_max, out=self.scratchDetectObstacle)
+        np.minimum(ranges, msg.range_max, out=ranges)
+
+        # Zero the invalid rays as well: a NaN return would otherwise
+        # survive the clamp, flow through the endpoint arithmetic and
+        # hit the int32 cast as an invalid conversion. The zeroed
+        # rays are still excluded from the kernel call below.
+        ranges[~valid] = 0.0
+
+        validRayIndices = np.flatnonzero(valid)
+
+        # Rotate the cached unit vectors for the scan-relative ray
+        # angles by the robot heading, scale by the ray lengths and
+        # convert straight to cell coordinates, all as one in-place
+        # expression chain: the heading rotation costs two scalar
+        # trig calls, the origin shift is folded into a single add
+        # and no intermediate arrays are materialised. The final
+        # assignment into the int32 buffers truncates, matching
+        # getCellCoordinatesFromWorldCoordinates.
+        cosTheta = math.cos(theta)
+        sinTheta = math.sin(theta)
+        inverseResolution = self.inverseResolution
+        originX = self.gridOriginX
+        originY = self.gridOriginY
+
+        endWorldX = self.scratchEndWorldX
+        endWorldY = self.scratchEndWorldY
+        temp = self.scratchTemp
+
+        np.multiply(cosTable, cosTheta, out=endWorldX)
+        np.multiply(sinTable, sinTheta, out=temp)
+        np.subtract(endWorldX, temp, out=endWorldX)
+        np.multiply(endWorldX, ranges, out=endWorldX)
+        np.add(endWorldX, x - originX, out=endWorldX)
+        np.multiply(endWorldX, inverseResolution, out=endWorldX)
+
+        np.multiply(cosTable, sinTheta, out=endWorldY)
+        np.multiply(sinTable, cosTheta, out=temp)
+        np.add(endWorldY, temp, out=endWorldY)
+        np.multiply(endWorldY, ranges, out=endWorldY)
+        np.add(endWorldY, y - originY, out=endWorldY)
+        np.multiply(endWorldY, inverseResolution, out=endWorldY)
+
+        endCellX = self.scratchEndCellX
+        endCellY = self.scratchEndCellY
+        endCellX[:] = endWorldX
+        endCellY[:] = endWorldY
+
+        startCellX = int((x - originX) * inverseResolution)
+        startCellY = int((y - originY) * inverseResolution)
+
+        # Work directly on the underlying grid arrays; going through
+        # getCell / setCell for every traversed cell is far too slow.
+        occ = self.occupancyGrid.getGrid()
+        delta = self.deltaOccupancyGrid.getGrid()
+        widthInCells = self.occupancyGrid.getWidthInCells()
+        heightInCells = self.occupancyGrid.getHeightInCells()
+
+        distanceTransform = self.getFreeSpaceDistanceTransform()
+        visited = self.visitedCells
+
+        # The whole scan is integrated with a single kernel call; no
+        # per-ray work happens at the Python level at all.
+        if distanceTransform is None:
+            distanceTransform = self.emptyDistanceTransform
+            useDistanceTransform = False
+        else:
+            useDistanceTransform = True
+
+        gridHasChanged = integrate_scan(occ, delta, distanceTransform, visited,
+                                        widthInCells, heightInCells,
+                                        startCellX, startCellY,
+                                        endCellX[validRayIndices], endCellY[validRayIndices],
+                                        detectObstacle[validRayIndices],
+                                        useDistanceTransform)
+
+        visited.fill(0)
+
+        if gridHasChanged:
+            self.freeSpaceDistanceTransformStale = True
+
+        return gridHasChanged
+
+    # Get the cos / sin of every scan-relative ray angle, building the
+    # tables on the first scan and rebuilding them only if the scan
+    # geometry somehow changes. The per-scan scratch buffers are
+    # sized to the scan, so they are (re)allocated at the same time.
+    def getScanRayTables(self, msg, numberOfRays):
+        key = (msg.angle_min, msg.angle_increment, numberOfRays)
+        if key != self.scanRayTableKey:
+            baseAngles = msg.angle_min + msg.angle_increment * np.arange(numberOfRays)
+            self.scanRayCosTable = np.cos(baseAngles)
+            self.scanRaySinTable = np.sin(baseAngles)
+            self.scratchRanges = np.empty(numberOfRays, dtype=np.float32)
+            self.scratchValid = np.empty(numberOfRays, dtype=bool)
+            self.scratchDetectObstacle = np.empty(numberOfRays, dtype=bool)
+            self.scratchEndWorldX = np.empty(numberOfRays, dtype=np.float64)
+            self.scratchEndWorldY = np.empty(numberOfRays, dtype=np.float64)
+            self.scratchEndCellX = np.empty(numberOfRays, dtype=np.int32)
+            self.scratchEndCellY = np.empty(numberOfRays, dtype=np.int32)
+            self.scratchTemp = np.empty(numberOfRays, dtype=np.float64)
+            self.scanRayTableKey = key
+        return self.scanRayCosTable, self.scanRaySinTable
+
+    # Get the distance transform used by the ray marching kernel,
+    # recomputing it if the grid has changed since it was last
+    # computed. The transform is computed over a 2D view of the grid
+    # but handed to the kernels flattened, matching the grid storage.
+    # Returns None if scipy is not available, in which case the
+    # caller traces every ray with Bresenham instead.
+    def getFreeSpaceDistanceTransform(self):
+        if distance_transform_cdt is None:
+            return None
+        if self.freeSpaceDistanceTransformStale:
+            freeCells = self.occupancyGrid.getGridAs2D() <= LOG_ODDS_FREE_THRESHOLD
+            self.freeSpaceDistanceTransform = \
+                distance_transform_cdt(freeCells, metric='chessboard').astype(np.int32).ravel()
+            self.freeSpaceDistanceTransformStale = False
+        return self.freeSpaceDistanceTransform
+
+    def laserScanCallback(self, msg):
+        self.parseScan(msg)
+
+        # count_nonzero on the int8 delta grid is a single vectorised
+        # pass, so checking costs far less than publishing.
+        changedCellCount = np.count_nonzero(self.deltaOccupancyGrid.getGrid())
+
+        if changedCellCount == 0:
+            return
+
+        timestamp = msg.header.stamp
+        if (changedCellCount < self.changedCellPublishThreshold) and \
+                (self.lastPublishTime is not None) and \
+                ((timestamp - self.lastPublishTime).to_sec() < self.maximumPublishInterval):
+            return
+
+        mapUpdateMessage = self.constructMapUpdateMessage(timestamp)
+        self.mapUpdatePublisher.publish(mapUpdateMessage)
+        self.lastPublishTime = timestamp
+
+        # The delta grid only records changes since the last update
+        # message, so clear it now the message has gone out.
+        self.deltaOccupancyGrid.clearMap(0)
+
+    def constructMapUpdateMessage(self, timestamp):
+        mapUpdateMessage = MapUpdate()
+        mapUpdateMessage.header.stamp = timestamp
+        mapUpdateMessage.resolution = self.occupancyGrid.getResolution()
+        mapUpdateMessage.widthInCells = self.occupancyGrid.getWidthInCells()
+        mapUpdateMessage.heightInCells = self.occupancyGrid.getHeightInCells()
+
+        # Ship only the cells which changed since the last update; on
+        # a typical scan this is a tiny fraction of the grid. The
+        # lookup table conversion produces a fresh array, so nothing
+        # in the message aliases the live grid.
+        probabilities = self.occupancyGrid.getGridAsProbabilities()
+        changedCellIndices = np.flatnonzero(self.deltaOccupancyGrid.getGrid())
+        mapUpdateMessage.changedCellIndices = changedCellIndices.tolist()
+        mapUpdateMessage.changedCellValues = probabilities[changedCellIndices].tolist()
+
+        # Include the full grid as a periodic keyframe so that late
+        # joiners can synchronise.
+        if (self.lastKeyframeTime is None) or \
+                ((timestamp - self.lastKeyframeTime).to_sec() >= self.keyframeInterval):
+            self.keyframeSequenceNumber = self.keyframeSequenceNumber + 1
+            self.lastKeyframeTime = timestamp
+            mapUpdateMessage.isKeyframe = True
+            mapUpdateMessage.occupancyGrid = probabilities.tolist()
+
+        mapUpdateMessage.keyframeSequenceNumber = self.keyframeSequenceNumber
+        return mapUpdateMessage
+
+    def run(self):
+        rospy.spin()
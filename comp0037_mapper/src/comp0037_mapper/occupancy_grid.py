@@ -0,0 +1,126 @@
+import numpy as np
+
+# This class stores the occupancy grid. This is a "chessboard-like"
+# representation of the world. The world is quantised into cells of
+# size resolution x resolution metres. Each cell stores the log odds
+# of the cell being blocked as a saturating 8 bit integer: 0 means
+# unknown, each ray passing through the cell adds LOG_ODDS_FREE and
+# each ray ending on it adds LOG_ODDS_OCCUPIED. A cell is classified
+# as free or blocked once its value crosses the corresponding
+# threshold; this means a single noisy ray can no longer flip the
+# state of a well-observed cell back and forth.
+
+LOG_ODDS_FREE = -2
+LOG_ODDS_OCCUPIED = 3
+LOG_ODDS_MIN = -127
+LOG_ODDS_MAX = 127
+LOG_ODDS_FREE_THRESHOLD = -20
+LOG_ODDS_OCCUPIED_THRESHOLD = 20
+
+# Lookup table which converts a raw int8 log odds value, viewed as a
+# uint8 index, into the 0 (free), 0.5 (unknown) or 1 (blocked)
+# probability used in the published messages.
+def _buildProbabilityLookupTable():
+    logOdds = np.arange(256, dtype=np.uint8).view(np.int8)
+    table = np.full(256, 0.5)
+    table[logOdds <= LOG_ODDS_FREE_THRESHOLD] = 0.0
+    table[logOdds >= LOG_ODDS_OCCUPIED_THRESHOLD] = 1.0
+    return table
+
+_PROBABILITY_LOOKUP_TABLE = _buildProbabilityLookupTable()
+
+class OccupancyGrid(object):
+
+    # Construct a new occupancy grid with a given width and height in
+    # cells. Every cell starts off in the unknown state.
+    def __init__(self, widthInCells, heightInCells, resolution, initialValue = 0):
+        self.widthInCells = widthInCells
+        self.heightInCells = heightInCells
+        self.resolution = resolution
+
+        # The origin of the grid in workspace coordinates. Cell (0, 0)
+        # spans the world coordinates [originX, originX + resolution) x
+        # [originY, originY + resolution).
+        self.originX = 0.0
+        self.originY = 0.0
+
+        # The grid itself is stored as a single flat contiguous numpy
+        # array in row-major order, so cell (x, y) lives at index
+        # y * widthInCells + x. The scan integration kernels work on
+        # this array directly: keeping it 1D means one address
+        # computation per cell access and lets batches of cells be
+        # read or written with a single fancy-indexing operation.
+        self._grid = np.full(heightInCells * widthInCells, initialValue, dtype=np.int8)
+
+    # Get the underlying flat numpy array which stores the grid. This
+    # is used by the scan integration kernels, which are far too slow
+    # if they have to access the grid one cell at a time.
+    def getGrid(self):
+        return self._grid
+
+    # Get a 2D [y, x] view of the grid. No data is copied.
+    def getGridAs2D(self):
+        return self._grid.reshape(self.heightInCells, self.widthInCells)
+
+    # Take a copy of this grid. The cell array is duplicated with a
+    # single block copy, which is vastly cheaper than running the
+    # whole object through copy.deepcopy.
+    def snapshot(self):
+        gridCopy = OccupancyGrid(self.widthInCells, self.heightInCells, self.resolution)
+        gridCopy.originX = self.originX
+        gridCopy.originY = self.originY
+        gridCopy._grid = self._grid.copy()
+        return gridCopy
+
+    def getWidthInCells(self):
+        return self.widthInCells
+
+    def getHeightInCells(self):
+        return self.heightInCells
+
+    def getResolution(self):
+        return self.resolution
+
+    # The width and height of the workspace the grid spans, in metres.
+    def getWidth(self):
+        return self.widthInCells * self.resolution
+
+    def getHeight(self):
+        return self.heightInCells * self.resolution
+
+    # Get the raw log odds value of a cell.
+    def getCell(self, x, y):
+        return self._grid[y * self.widthInCells + x]
+
+    # Set the raw log odds value of a cell.
+    def setCell(self, x, y, c):
+        self._grid[y * self.widthInCells + x] = c
+
+    # Convert the whole grid to 0 / 0.5 / 1 probabilities via the
+    # lookup table; this is only done when a message is published.
+    def getGridAsProbabilities(self):
+        return _PROBABILITY_LOOKUP_TABLE[self._grid.view(np.uint8)]
+
+    # Set every cell in the grid to the same value. This is done as a
+    # single array fill rather than looping over setCell; the delta
+    # grid is cleared this way after every publish, so the per-cell
+    # loop was costing O(width * height) Python operations each time.
+    def clearMap(self, value):
+        self._grid.fill(value)
+
+    # Take a position in workspace coordinates and figure out which
+    # cell contains it.
+    def getCellCoordinatesFromWorldCoordinates(self, worldCoords):
+        cellCoords = (int((worldCoords[0] - self.originX) / self.resolution), \
+                      int((worldCoords[1] - self.originY) / self.resolution))
+        return cellCoords
+
+    # Take a cell and work out the workspace coordinates of its centre.
+    def getWorldCoordinatesFromCellCoordinates(self, cellCoords):
+        worldCoords = ((cellCoords[0] + 0.5) * self.resolution + self.originX, \
+                       (cellCoords[1] + 0.5) * self.resolution + self.originY)
+        return worldCoords
+
+    # Check if a cell lies on the grid.
+    def isCellInGrid(self, x, y):
+        return (x >= 0) and (y >= 0) and (x < self.widthInCells) and (y < self.heightInCells)